@@ -1,8 +1,15 @@
 import os
-import json
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import math
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Optional, Literal
+
+import asyncpg
+import orjson
+import redis.asyncio as redis
 from dotenv import load_dotenv
+from pydantic import BaseModel, ConfigDict, model_validator
 
 load_dotenv()
 
@@ -13,23 +20,306 @@ FEATURES_TABLE = os.getenv("FEATURES_TABLE", "osm_spb_features")
 if not DATABASE_URL:
     raise RuntimeError("Missing DATABASE_URL. Put it in .env or environment variables.")
 
+logger = logging.getLogger(__name__)
+
+# 进程级异步连接池：在 FastAPI startup 中创建，shutdown 时关闭
+PG_POOL_MIN = int(os.getenv("PG_POOL_MIN", 5))
+PG_POOL_MAX = int(os.getenv("PG_POOL_MAX", 20))
+# 经 PgBouncer（pool_mode=transaction）连接时必须关闭服务端预备语句缓存：
+# 同一客户端连接的前后事务可能落在不同的后端上，命名预备语句会失效。
+# 直连 PostgreSQL 时可设置为正数（asyncpg 默认 100）以复用语句。
+PG_STATEMENT_CACHE_SIZE = int(os.getenv("PG_STATEMENT_CACHE_SIZE", 0))
+
+POOL: Optional[asyncpg.Pool] = None
+
+# FEATURES_TABLE.tags 是否为 jsonb：启动时检测一次。不是 jsonb 时请求中带 tags 直接返回 400
+TAGS_JSONB = False
+
+def _json_dumps(obj):
+    return orjson.dumps(obj).decode()
+
+# 新后端第一次 ST_Transform 到某个 EPSG 时要初始化 PROJ（读取 proj.db、建立转换管线），
+# 连接建立时先对常用目标投影各做一次，避免落到第一个用户请求上
+PROJ_WARMUP_EPSG = [int(x) for x in os.getenv("PROJ_WARMUP_EPSG", "3857,3395").split(",") if x.strip()]
+
+async def _init_conn(conn):
+    # json/jsonb 列直接解码为 Python 对象（与 psycopg2 的行为一致）
+    for typename in ("json", "jsonb"):
+        await conn.set_type_codec(
+            typename, encoder=_json_dumps, decoder=orjson.loads, schema="pg_catalog"
+        )
+    if PROJ_WARMUP_EPSG:
+        await conn.execute(
+            """
+            SELECT ST_Transform(ST_SetSRID(ST_MakePoint(0, 0), 4326), e)
+            FROM unnest($1::int[]) AS e;
+            """,
+            PROJ_WARMUP_EPSG,
+        )
+
+TAGS_TYPE_SQL = """
+SELECT format_type(atttypid, NULL) FROM pg_attribute
+WHERE attrelid = to_regclass($1) AND attname = 'tags' AND NOT attisdropped
+"""
+
+async def init_pool():
+    global POOL, TAGS_JSONB
+    POOL = await asyncpg.create_pool(
+        DATABASE_URL,
+        min_size=PG_POOL_MIN,
+        max_size=PG_POOL_MAX,
+        command_timeout=60,
+        statement_cache_size=PG_STATEMENT_CACHE_SIZE,
+        init=_init_conn,
+    )
+    TAGS_JSONB = await POOL.fetchval(TAGS_TYPE_SQL, FEATURES_TABLE) == "jsonb"
+
+async def close_pool():
+    if POOL is not None:
+        await POOL.close()
+
+# 启动时的迁移：所有查询都依赖 geom 上的空间索引（ST_Covers / ST_Intersects /
+# ST_DWithin / KNN 的 <->），geography 表达式索引用于 geom::geography 的距离查询。
+# 表上已有同类索引（名字不限，例如 ogr2ogr 建的 <table>_geom_geom_idx）就不再新建
+SPATIAL_INDEXES = [
+    # (表名, 新建时的索引名, 访问方法, 索引键（去掉括号和空白后比较）, 索引定义)
+    (FEATURES_TABLE, f"{FEATURES_TABLE.split('.')[-1]}_geom_gix", "gist", "geom", "GIST (geom)"),
+    (REGIONS_TABLE, f"{REGIONS_TABLE.split('.')[-1]}_geom_gix", "gist", "geom", "GIST (geom)"),
+    (FEATURES_TABLE, f"{FEATURES_TABLE.split('.')[-1]}_geog_gix", "gist", "geom::geography", "GIST ((geom::geography))"),
+]
+# tags 为 jsonb 时再建 GIN 索引，支持 tags @> '{"amenity": "cafe"}' 这类包含过滤
+TAGS_INDEX = (FEATURES_TABLE, f"{FEATURES_TABLE.split('.')[-1]}_tags_gin", "gin", "tags", "GIN (tags jsonb_path_ops)")
+
+# 按表的 oid 查找，不依赖 search_path；只看第一个索引键
+HAS_INDEX_SQL = """
+SELECT EXISTS (
+  SELECT 1
+  FROM pg_index i
+  JOIN pg_class c ON c.oid = i.indexrelid
+  JOIN pg_am am ON am.oid = c.relam
+  WHERE i.indrelid = to_regclass($1)
+    AND i.indisvalid
+    AND am.amname = $2
+    AND regexp_replace(pg_get_indexdef(i.indexrelid, 1, true), '[()[:space:]]', '', 'g') = $3
+)
+"""
+
+async def ensure_indexes():
+    """
+    Create missing spatial indexes and ANALYZE the tables that got a new one.
+    Safe to run from several workers at once (serialised by an advisory lock).
+    Missing tables are skipped, and a role that may not create indexes only
+    gets a warning, so startup never fails here.
+    """
+    indexes = SPATIAL_INDEXES + ([TAGS_INDEX] if TAGS_JSONB else [])
+    # 单独的连接，不设 command_timeout：大表上建索引、等待其他 worker 的锁都可能超过 60 秒
+    # （池连接上 timeout=None 会退回到连接池的 command_timeout）
+    conn = await asyncpg.connect(DATABASE_URL, statement_cache_size=PG_STATEMENT_CACHE_SIZE)
+    try:
+        async with conn.transaction():
+            await conn.execute("SET LOCAL statement_timeout = 0")
+            await conn.execute("SELECT pg_advisory_xact_lock(hashtext('geo_api_migrations'))")
+            analyze = set()
+            for table, index_name, method, key, definition in indexes:
+                if await conn.fetchval("SELECT to_regclass($1)", table) is None:
+                    logger.info("table %s not found, skipping index %s", table, index_name)
+                    continue
+                if await conn.fetchval(HAS_INDEX_SQL, table, method, key):
+                    continue
+                try:
+                    async with conn.transaction():
+                        await conn.execute(
+                            f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} USING {definition};"
+                        )
+                except asyncpg.InsufficientPrivilegeError as e:
+                    logger.warning("cannot create index %s on %s: %s", index_name, table, e)
+                    continue
+                analyze.add(table)
+
+            for table in sorted(analyze):
+                await conn.execute(f"ANALYZE {table};")
+    finally:
+        await conn.close()
+
 def get_conn():
-    return psycopg2.connect(DATABASE_URL)
-
-def rows_to_featurecollection(rows, geom_key="geom_geojson"):
-    features = []
-    for r in rows:
-        r = dict(r)
-        geom = r.pop(geom_key, None)
-        if geom is None:
-            continue
-        # geom is already a JSON object (from ST_AsGeoJSON(...)::json)
-        features.append({
-            "type": "Feature",
-            "geometry": geom,
-            "properties": r
-        })
-    return {"type": "FeatureCollection", "features": features}
+    """
+    Borrow a connection from the pool:
+        async with get_conn() as conn:
+            rows = await conn.fetch(sql, ...)
+    """
+    return POOL.acquire()
+
+# 用户多边形缓存：规范化 GeoJSON 的哈希 -> EWKB（SRID 4326）
+# 前端平移地图时会反复发送同一个多边形，命中后不必再让 PostGIS 解析 GeoJSON 文本
+POLY_CACHE_SIZE = int(os.getenv("POLY_CACHE_SIZE", 1024))
+POLY_CACHE: "OrderedDict[bytes, bytes]" = OrderedDict()
+
+def geom_cache_key(geom):
+    canonical = orjson.dumps(geom, option=orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(canonical, digest_size=16).digest()
+
+async def geoms_to_ewkb(conn, geoms):
+    """
+    Return the EWKB (SRID 4326) of each GeoJSON geometry, in order.
+    Cache misses are converted by PostGIS in a single round trip.
+    """
+    keys = [geom_cache_key(g) for g in geoms]
+    found = {}
+    missing = {}
+    for key, g in zip(keys, geoms):
+        if key in POLY_CACHE:
+            POLY_CACHE.move_to_end(key)
+            found[key] = POLY_CACHE[key]
+        elif key not in missing:
+            missing[key] = g
+
+    if missing:
+        rows = await conn.fetch(
+            """
+            SELECT ST_AsEWKB(ST_SetSRID(ST_GeomFromGeoJSON(e), 4326))
+            FROM jsonb_array_elements($1::jsonb) WITH ORDINALITY AS t(e, i)
+            ORDER BY i;
+            """,
+            list(missing.values()),
+        )
+        for key, row in zip(missing, rows):
+            found[key] = POLY_CACHE[key] = row[0]
+        while len(POLY_CACHE) > POLY_CACHE_SIZE:
+            POLY_CACHE.popitem(last=False)
+
+    return [found[k] for k in keys]
+
+async def geom_to_ewkb(conn, geom):
+    return (await geoms_to_ewkb(conn, [geom]))[0]
+
+# 结果缓存（可选）：面积/周长/坐标转换只取决于输入几何，命中时一次 Redis GET 即可返回。
+# 未设置 REDIS_URL 时不启用。
+REDIS_URL = os.getenv("REDIS_URL")
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", 3600))
+# 连接/读写超时（秒）：Redis 卡住时按未命中处理，而不是拖住请求
+REDIS_TIMEOUT = float(os.getenv("REDIS_TIMEOUT", 0.1))
+
+REDIS: Optional[redis.Redis] = redis.Redis.from_url(
+    REDIS_URL,
+    socket_connect_timeout=REDIS_TIMEOUT,
+    socket_timeout=REDIS_TIMEOUT,
+) if REDIS_URL else None
+
+async def cached_result(key, compute):
+    """
+    Return the JSON-serialisable result cached under `key`, or await compute()
+    and cache it for RESULT_CACHE_TTL seconds. Redis failures only cost a miss.
+    """
+    if REDIS is None:
+        return await compute()
+    try:
+        hit = await REDIS.get(key)
+    except redis.RedisError:
+        hit = None
+    if hit is not None:
+        return orjson.loads(hit)
+
+    result = await compute()
+    try:
+        await REDIS.setex(key, RESULT_CACHE_TTL, orjson.dumps(result))
+    except redis.RedisError:
+        pass
+    return result
+
+async def close_redis():
+    if REDIS is not None:
+        await REDIS.aclose()
+
+def meters_to_degrees(lat, meters):
+    """
+    Return (dx, dy) in degrees covering a `meters` radius around latitude `lat`.
+    Used for a cheap `geom && ST_Expand(pt, dx, dy)` bbox prefilter, so it errs
+    on the large side: the shortest meridian degree for dy, and the parallel at
+    the circle's poleward edge for dx.
+    """
+    dy = meters / 110574.0
+    edge_lat = min(abs(lat) + dy, 89.9)
+    dx = meters / (111320.0 * math.cos(math.radians(edge_lat)))
+    return dx, dy
+
+def _features_from(rows_sql, properties):
+    """
+    FROM clause exposing `t`: exactly the property columns plus `geom` for each
+    row of `rows_sql` (alias `f`), ready for ST_AsGeoJSON(t, 'geom').
+    """
+    cols = ", ".join(f"f.{c}" for c in properties)
+    return f"""FROM ({rows_sql}) f,
+           LATERAL (SELECT {cols}, f.geom) t
+      WHERE f.geom IS NOT NULL"""
+
+# ST_AsGeoJSON(record) 在 C 里一次写出完整的 Feature 文本：properties 即该行其余列的
+# row_to_json，geometry 不再经过 ST_AsGeoJSON(geom)::json 的二次解析
+def featurecollection_json(rows_sql, properties, order_by=None):
+    """
+    Wrap `rows_sql` (a SELECT exposing `geom` plus the property columns) into a
+    scalar subquery returning the whole GeoJSON FeatureCollection as text.
+    Rows with a NULL geometry are skipped.
+    """
+    order = f" ORDER BY f.{order_by}" if order_by else ""
+    return f"""(
+      SELECT '{{"type":"FeatureCollection","features":['
+             || COALESCE(string_agg(ST_AsGeoJSON(t, 'geom'), ','{order}), '')
+             || ']}}'
+      {_features_from(rows_sql, properties)}
+    )"""
+
+# 流式输出时每次从服务端游标取的行数
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", 200))
+
+async def stream_featurecollection(rows_sql, properties, make_args):
+    """
+    Return an async iterator over a GeoJSON FeatureCollection, chunk by chunk.
+    Features are built in PostgreSQL and read through a server-side cursor,
+    STREAM_BATCH_SIZE rows at a time, so memory stays flat whatever the LIMIT.
+
+    The connection is acquired, the cursor opened and the first batch fetched
+    before this returns, so query errors still become a normal error response
+    instead of a 200 with a truncated body. `make_args(conn)` is awaited on that
+    same connection to build the query arguments (e.g. EWKB cache lookups), so
+    a request holds a single pooled connection.
+    """
+    sql = f"""
+    SELECT ST_AsGeoJSON(t, 'geom')
+    {_features_from(rows_sql, properties)}
+    """
+    conn = await POOL.acquire()
+    tr = conn.transaction()
+
+    async def chunks():
+        try:
+            args = await make_args(conn)
+            await tr.start()
+            cur = await conn.cursor(sql, *args)
+            rows = await cur.fetch(STREAM_BATCH_SIZE)
+            # 第一批取到后先停在这里：出错时异常直接抛给调用方；
+            # 生成器已启动，即使响应从未发送，关闭时也会执行 finally 归还连接
+            yield None
+            yield '{"type":"FeatureCollection","features":['
+            sep = ""
+            while rows:
+                yield sep + ",".join(r[0] for r in rows)
+                sep = ","
+                rows = await cur.fetch(STREAM_BATCH_SIZE)
+            yield "]}"
+        finally:
+            await _end_stream(conn, tr)
+
+    stream = chunks()
+    await stream.__anext__()
+    return stream
+
+async def _end_stream(conn, tr):
+    # 只读查询：回滚即可结束事务，然后把连接还回连接池
+    try:
+        if conn.is_in_transaction():
+            await tr.rollback()
+    finally:
+        await POOL.release(conn)
 
 def one_geom_to_feature(geom_obj, properties=None):
     return {
@@ -38,22 +328,59 @@ def one_geom_to_feature(geom_obj, properties=None):
         "properties": properties or {}
     }
 
+def parse_tags_filter(tags):
+    """
+    Validate an optional tag filter such as {"amenity": "cafe"}.
+    Return None when it is absent or empty; reject it when tags is not jsonb.
+    """
+    if not tags:
+        return None
+    if not TAGS_JSONB:
+        raise ValueError(f"tag filters are not supported: {FEATURES_TABLE}.tags is not jsonb")
+    if not isinstance(tags, dict):
+        raise ValueError('tags must be an object, e.g. {"amenity": "cafe"}')
+    return tags
+
+class GeoJSONGeometry(BaseModel):
+    """Shape check for a GeoJSON Geometry, so bad input is rejected before PostGIS."""
+    model_config = ConfigDict(extra="allow")
+
+    type: Literal[
+        "Point", "MultiPoint", "LineString", "MultiLineString",
+        "Polygon", "MultiPolygon", "GeometryCollection",
+    ]
+    coordinates: Optional[list] = None
+    geometries: Optional[list] = None
+
+    @model_validator(mode="after")
+    def _check_members(self):
+        if self.type == "GeometryCollection":
+            if self.geometries is None:
+                raise ValueError("GeometryCollection requires 'geometries'")
+            for g in self.geometries:
+                GeoJSONGeometry.model_validate(g)
+        elif self.coordinates is None:
+            raise ValueError(f"{self.type} requires 'coordinates'")
+        return self
+
 def parse_geojson_geometry(geojson_obj):
     """
     Accept either:
       - a GeoJSON Feature (with "geometry")
       - a GeoJSON Geometry
     Return the Geometry dict.
+    Raises ValueError (incl. pydantic.ValidationError) for invalid input.
     """
     if geojson_obj is None:
         raise ValueError("geojson is required")
     # 允许前端误传字符串（例如直接传 JSON 字符串）
     if isinstance(geojson_obj, str):
-        geojson_obj = json.loads(geojson_obj)
+        geojson_obj = orjson.loads(geojson_obj)
 
     if not isinstance(geojson_obj, dict) or "type" not in geojson_obj:
         raise ValueError("Invalid GeoJSON: must be a dict with a 'type' field")
 
     if geojson_obj.get("type") == "Feature":
-        return geojson_obj.get("geometry")
+        geojson_obj = geojson_obj.get("geometry")
+    GeoJSONGeometry.model_validate(geojson_obj)
     return geojson_obj
@@ -1,16 +1,27 @@
-import json
+import os
+import base64
 from typing import Optional, List, Dict, Any
 
-from fastapi import FastAPI, Body, HTTPException
+from fastapi import FastAPI, Body, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+import shapely.wkb
+from shapely.geometry import mapping
 
 from db import (
-    get_conn, RealDictCursor,
+    get_conn, init_pool, close_pool, ensure_indexes,
     REGIONS_TABLE, FEATURES_TABLE,
-    rows_to_featurecollection, one_geom_to_feature, parse_geojson_geometry
+    featurecollection_json, stream_featurecollection,
+    one_geom_to_feature, parse_geojson_geometry, parse_tags_filter,
+    meters_to_degrees, geom_to_ewkb, geoms_to_ewkb,
+    geom_cache_key, cached_result, close_redis
 )
 
-app = FastAPI(title="PostGIS GeoJSON API (Leaflet)")
+# 默认用 orjson 序列化响应；PostgreSQL 已拼好的 JSON 文本则直接用 Response 原样返回
+app = FastAPI(
+    title="PostGIS GeoJSON API (Leaflet)",
+    default_response_class=ORJSONResponse,
+)
 
 # 开发阶段允许跨域，前端直接打开本地 html 也能调用
 app.add_middleware(
@@ -21,16 +32,42 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def startup():
+    await init_pool()
+    await ensure_indexes()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await close_pool()
+    await close_redis()
+
+# GeoJSON 校验失败（ValueError / pydantic.ValidationError）返回 400，而不是 500
+@app.exception_handler(ValueError)
+async def value_error_handler(request, exc):
+    return ORJSONResponse(status_code=400, content={"detail": str(exc)})
+
+# FeatureCollection 由 PostgreSQL 直接拼成 JSON 文本，原样返回，不在 Python 里逐行重建
+def json_response(text):
+    return Response(content=text, media_type="application/json")
+
+FEATURE_PROPS = ("id", "osmid", "element_type", "name", "tags")
+
+# 可选的 tags 过滤：jsonb 包含运算 @>，由 tags 上的 GIN 索引支持；$n 为该过滤参数的位置
+def tags_filter(param_no):
+    return f"AND tags @> ${param_no}::jsonb"
+
 # ---------- 0) 健康检查 ----------
 @app.get("/health")
-def health():
+async def health():
     return {"ok": True}
 
 
 # ---------- 1) 点在多边形内（Point in Polygon） ----------
 # 默认对 FEATURES_TABLE（osm_spb_features）做点落面查询；如需对 regions 表查询，传 source="regions"
+# 只对面要素进行点落面，避免对点/线做 covers（会返回空）
 @app.post("/q/pip")
-def point_in_polygon(payload: Dict[str, Any] = Body(...)):
+async def point_in_polygon(payload: Dict[str, Any] = Body(...)):
     lon = payload.get("lon")
     lat = payload.get("lat")
     source = (payload.get("source") or "features").lower()  # features | regions
@@ -39,137 +76,163 @@ def point_in_polygon(payload: Dict[str, Any] = Body(...)):
         raise HTTPException(400, "lon/lat required")
 
     table = REGIONS_TABLE if source == "regions" else FEATURES_TABLE
-    # 只对面要素进行点落面，避免对点/线做 covers（会返回空）
-    geom_filter = "GeometryType(geom) IN ('POLYGON','MULTIPOLYGON')"
-    sql = f"""
+    rows_sql = f"""
     SELECT id,
            COALESCE(name, '') AS name,
-           ST_AsGeoJSON(geom)::json AS geom_geojson
+           geom
     FROM {table}
-    WHERE {geom_filter}
-      AND ST_Covers(geom, ST_SetSRID(ST_MakePoint(%s, %s), 4326))
-    LIMIT %s;
+    WHERE GeometryType(geom) IN ('POLYGON','MULTIPOLYGON')
+      AND ST_Covers(geom, ST_SetSRID(ST_MakePoint($1, $2), 4326))
+    LIMIT $3
     """
+    sql = f"SELECT {featurecollection_json(rows_sql, ('id', 'name'))};"
 
-    with get_conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute(sql, (lon, lat, limit))
-        rows = cur.fetchall()
+    async with get_conn() as conn:
+        fc = await conn.fetchval(sql, float(lon), float(lat), limit)
 
-    return rows_to_featurecollection(rows)
+    return json_response(fc)
 
 
 # ---------- 2) 多边形相交查询（Polygon intersects） ----------
 # 默认与 FEATURES_TABLE 做相交查询；如需与 regions 表查询，传 source="regions"
 @app.post("/q/intersects")
-def polygon_intersects(payload: Dict[str, Any] = Body(...)):
+async def polygon_intersects(payload: Dict[str, Any] = Body(...)):
     geojson = payload.get("geojson")
     geom = parse_geojson_geometry(geojson)
     source = (payload.get("source") or "features").lower()
     limit = int(payload.get("limit", 500))
 
     table = REGIONS_TABLE if source == "regions" else FEATURES_TABLE
-    sql = f"""
+    rows_sql = f"""
     WITH q AS (
-      SELECT ST_SetSRID(ST_GeomFromGeoJSON(%s), 4326) AS g
+      SELECT ST_GeomFromEWKB($1::bytea) AS g
     )
     SELECT id,
            COALESCE(name, '') AS name,
-           ST_AsGeoJSON(geom)::json AS geom_geojson
+           geom
     FROM {table}, q
-    WHERE ST_Intersects(geom, q.g)
-    LIMIT %s;
+    WHERE geom && q.g
+      AND ST_Intersects(geom, q.g)
+    LIMIT $2
     """
 
-    with get_conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute(sql, (json.dumps(geom), limit))
-        rows = cur.fetchall()
+    # EWKB 转换与流式查询共用同一个连接
+    async def make_args(conn):
+        return await geom_to_ewkb(conn, geom), limit
 
-    return rows_to_featurecollection(rows)
+    # 复杂多边形的结果可能很大：用服务端游标分批流式返回，客户端先收到前面的要素
+    chunks = await stream_featurecollection(rows_sql, ("id", "name"), make_args)
+    return StreamingResponse(chunks, media_type="application/json")
 
 
 # ---------- 3) 距离范围查询（DWithin） ----------
 @app.post("/q/within-distance")
-def within_distance(payload: Dict[str, Any] = Body(...)):
+async def within_distance(payload: Dict[str, Any] = Body(...)):
     lon = payload.get("lon")
     lat = payload.get("lat")
     radius_m = payload.get("radius_m")
     limit = int(payload.get("limit", 500))
+    tags = parse_tags_filter(payload.get("tags"))  # 例如 {"amenity": "cafe"}
 
     if lon is None or lat is None or radius_m is None:
         raise HTTPException(400, "lon/lat/radius_m required")
 
-    sql = f"""
-    WITH p AS (
-      SELECT ST_SetSRID(ST_MakePoint(%s, %s), 4326) AS pt
-    )
-    SELECT id, osmid, element_type, name,
-           tags,
-           ST_Distance(geom::geography, p.pt::geography) AS dist_m,
-           ST_AsGeoJSON(geom)::json AS geom_geojson
-    FROM {FEATURES_TABLE}, p
-    WHERE ST_DWithin(geom::geography, p.pt::geography, %s)
-    ORDER BY dist_m
-    LIMIT %s;
-    """
+    lon, lat, radius_m = float(lon), float(lat), float(radius_m)
+
+    if radius_m == 0:
+        # 半径为 0 等价于“与该点相交”，直接用 ST_Intersects，不做 geography 距离计算
+        rows_sql = f"""
+        WITH p AS (
+          SELECT ST_SetSRID(ST_MakePoint($1, $2), 4326) AS pt
+        )
+        SELECT id, osmid, element_type, name,
+               tags,
+               0.0::float8 AS dist_m,
+               geom
+        FROM {FEATURES_TABLE}, p
+        WHERE ST_Intersects(geom, p.pt)
+          {tags_filter(4) if tags else ""}
+        LIMIT $3
+        """
+        sql = f"SELECT {featurecollection_json(rows_sql, FEATURE_PROPS + ('dist_m',))};"
+        args = (lon, lat, limit)
+    else:
+        # geometry 空间的 bbox 预过滤（走 geom 的 GiST 索引），再做精确的椭球面距离判断
+        rows_sql = f"""
+        WITH p AS (
+          SELECT ST_SetSRID(ST_MakePoint($1, $2), 4326) AS pt
+        )
+        SELECT id, osmid, element_type, name,
+               tags,
+               ST_Distance(geom::geography, p.pt::geography) AS dist_m,
+               geom
+        FROM {FEATURES_TABLE}, p
+        WHERE geom && ST_Expand(p.pt, $5, $6)
+          AND ST_DWithin(geom::geography, p.pt::geography, $3)
+          {tags_filter(7) if tags else ""}
+        ORDER BY dist_m
+        LIMIT $4
+        """
+        sql = f"SELECT {featurecollection_json(rows_sql, FEATURE_PROPS + ('dist_m',), 'dist_m')};"
+        dx, dy = meters_to_degrees(lat, radius_m)
+        args = (lon, lat, radius_m, limit, dx, dy)
+    if tags:
+        args += (tags,)
 
-    with get_conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute(sql, (lon, lat, radius_m, limit))
-        rows = cur.fetchall()
+    async with get_conn() as conn:
+        fc = await conn.fetchval(sql, *args)
 
-    return rows_to_featurecollection(rows)
+    return json_response(fc)
 
 
 # ---------- 4) 缓冲区分析（Buffer + 选中要素） ----------
 @app.post("/q/buffer")
-def buffer_analysis(payload: Dict[str, Any] = Body(...)):
+async def buffer_analysis(payload: Dict[str, Any] = Body(...)):
     lon = payload.get("lon")
     lat = payload.get("lat")
     buffer_m = payload.get("buffer_m")
     limit = int(payload.get("limit", 1000))
+    tags = parse_tags_filter(payload.get("tags"))
 
     if lon is None or lat is None or buffer_m is None:
         raise HTTPException(400, "lon/lat/buffer_m required")
 
     # 返回：buffer polygon（Feature） + 命中要素（FeatureCollection）
-    buffer_sql = """
-    SELECT ST_AsGeoJSON(
-             ST_Buffer(ST_SetSRID(ST_MakePoint(%s,%s),4326)::geography, %s)::geometry
-           )::json AS geom_geojson;
-    """
-
+    # 一次查询完成：缓冲区同时用于输出和相交判断；MATERIALIZED 保证 ST_Buffer 只算一次
     hits_sql = f"""
-    WITH buf AS (
-      SELECT ST_Buffer(ST_SetSRID(ST_MakePoint(%s,%s),4326)::geography, %s)::geometry AS g
-    )
-    SELECT id, osmid, element_type, name, tags,
-           ST_AsGeoJSON(geom)::json AS geom_geojson
-    FROM {FEATURES_TABLE}, buf
+    SELECT id, osmid, element_type, name, tags, geom
+    FROM {FEATURES_TABLE}
     WHERE ST_Intersects(geom, buf.g)
-    LIMIT %s;
+      {tags_filter(5) if tags else ""}
+    LIMIT $4
+    """
+    sql = f"""
+    WITH buf AS MATERIALIZED (
+      SELECT ST_Buffer(ST_SetSRID(ST_MakePoint($1,$2),4326)::geography, $3)::geometry AS g
+    )
+    SELECT '{{"buffer":{{"type":"Feature","geometry":' || ST_AsGeoJSON(buf.g)
+           || ',"properties":' || json_build_object('buffer_m', $3)::text
+           || '}},"hits":' || {featurecollection_json(hits_sql, FEATURE_PROPS)}
+           || '}}'
+    FROM buf;
     """
 
-    with get_conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute(buffer_sql, (lon, lat, buffer_m))
-        buf_geom = cur.fetchone()["geom_geojson"]
-
-        cur.execute(hits_sql, (lon, lat, buffer_m, limit))
-        rows = cur.fetchall()
+    args = (float(lon), float(lat), float(buffer_m), limit) + ((tags,) if tags else ())
+    async with get_conn() as conn:
+        out = await conn.fetchval(sql, *args)
 
-    return {
-        "buffer": one_geom_to_feature(buf_geom, {"buffer_m": buffer_m}),
-        "hits": rows_to_featurecollection(rows)
-    }
+    return json_response(out)
 
 
 # ---------- 5) 计算多边形面积（Area） ----------
 @app.post("/q/area")
-def polygon_area(payload: Dict[str, Any] = Body(...)):
+async def polygon_area(payload: Dict[str, Any] = Body(...)):
     geojson = payload.get("geojson")
     geom = parse_geojson_geometry(geojson)
 
     sql = """
     WITH q AS (
-      SELECT ST_SetSRID(ST_GeomFromGeoJSON(%s), 4326) AS g
+      SELECT ST_GeomFromEWKB($1::bytea) AS g
     )
     SELECT
       ST_Area(q.g::geography) AS area_m2,
@@ -177,22 +240,23 @@ def polygon_area(payload: Dict[str, Any] = Body(...)):
     FROM q;
     """
 
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute(sql, (json.dumps(geom),))
-        area_m2, area_km2 = cur.fetchone()
+    async def compute():
+        async with get_conn() as conn:
+            area_m2, area_km2 = await conn.fetchrow(sql, await geom_to_ewkb(conn, geom))
+        return {"area_m2": float(area_m2), "area_km2": float(area_km2)}
 
-    return {"area_m2": float(area_m2), "area_km2": float(area_km2)}
+    return await cached_result(b"area:" + geom_cache_key(geom), compute)
 
 
 # ---------- 6) 计算多边形周长（Perimeter） ----------
 @app.post("/q/perimeter")
-def polygon_perimeter(payload: Dict[str, Any] = Body(...)):
+async def polygon_perimeter(payload: Dict[str, Any] = Body(...)):
     geojson = payload.get("geojson")
     geom = parse_geojson_geometry(geojson)
 
     sql = """
     WITH q AS (
-      SELECT ST_SetSRID(ST_GeomFromGeoJSON(%s), 4326) AS g
+      SELECT ST_GeomFromEWKB($1::bytea) AS g
     )
     SELECT
       ST_Perimeter(q.g::geography) AS perim_m,
@@ -200,45 +264,55 @@ def polygon_perimeter(payload: Dict[str, Any] = Body(...)):
     FROM q;
     """
 
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute(sql, (json.dumps(geom),))
-        perim_m, perim_km = cur.fetchone()
+    async def compute():
+        async with get_conn() as conn:
+            perim_m, perim_km = await conn.fetchrow(sql, await geom_to_ewkb(conn, geom))
+        return {"perimeter_m": float(perim_m), "perimeter_km": float(perim_km)}
 
-    return {"perimeter_m": float(perim_m), "perimeter_km": float(perim_km)}
+    return await cached_result(b"perimeter:" + geom_cache_key(geom), compute)
 
 
 # ---------- 7) 最近邻（KNN） ----------
 @app.post("/q/knn")
-def knn(payload: Dict[str, Any] = Body(...)):
+async def knn(payload: Dict[str, Any] = Body(...)):
     lon = payload.get("lon")
     lat = payload.get("lat")
     k = int(payload.get("k", 10))
+    tags = parse_tags_filter(payload.get("tags"))
 
     if lon is None or lat is None:
         raise HTTPException(400, "lon/lat required")
 
-    sql = f"""
-    WITH p AS (
-      SELECT ST_SetSRID(ST_MakePoint(%s, %s), 4326) AS pt
+    # 先用廉价的 geometry <-> 运算符（KNN 索引扫描）取前 K 个，
+    # 再只对这 K 行计算 geography 距离和 GeoJSON
+    rows_sql = f"""
+    WITH p AS NOT MATERIALIZED (
+      SELECT ST_SetSRID(ST_MakePoint($1, $2), 4326) AS pt
     )
-    SELECT id, osmid, element_type, name, tags,
-           ST_Distance(geom::geography, p.pt::geography) AS dist_m,
-           ST_AsGeoJSON(geom)::json AS geom_geojson
-    FROM {FEATURES_TABLE}, p
-    ORDER BY geom <-> p.pt
-    LIMIT %s;
+    SELECT n.id, n.osmid, n.element_type, n.name, n.tags,
+           ST_Distance(n.geom::geography, p.pt::geography) AS dist_m,
+           n.geom, n.knn_dist
+    FROM (
+      SELECT id, osmid, element_type, name, tags, geom,
+             geom <-> p.pt AS knn_dist
+      FROM {FEATURES_TABLE}, p
+      WHERE TRUE {tags_filter(4) if tags else ""}
+      ORDER BY geom <-> p.pt
+      LIMIT $3
+    ) n, p
     """
+    sql = f"SELECT {featurecollection_json(rows_sql, FEATURE_PROPS + ('dist_m',), 'knn_dist')};"
 
-    with get_conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute(sql, (lon, lat, k))
-        rows = cur.fetchall()
+    args = (float(lon), float(lat), k) + ((tags,) if tags else ())
+    async with get_conn() as conn:
+        fc = await conn.fetchval(sql, *args)
 
-    return rows_to_featurecollection(rows)
+    return json_response(fc)
 
 
 # ---------- 8) 聚合操作：多边形合并（Union） ----------
 @app.post("/q/union")
-def union_polygons(payload: Dict[str, Any] = Body(...)):
+async def union_polygons(payload: Dict[str, Any] = Body(...)):
     # 方式A：传 regions 的 id 列表
     region_ids: Optional[List[int]] = payload.get("region_ids")
     # 方式B：传多边形数组（GeoJSON geometry/feature）
@@ -248,11 +322,10 @@ def union_polygons(payload: Dict[str, Any] = Body(...)):
         sql = f"""
         SELECT ST_AsGeoJSON(ST_Union(geom))::json AS geom_geojson
         FROM {REGIONS_TABLE}
-        WHERE id = ANY(%s);
+        WHERE id = ANY($1);
         """
-        with get_conn() as conn, conn.cursor() as cur:
-            cur.execute(sql, (region_ids,))
-            row = cur.fetchone()
+        async with get_conn() as conn:
+            row = await conn.fetchrow(sql, [int(i) for i in region_ids])
         if not row or row[0] is None:
             raise HTTPException(404, "No geometries found for given region_ids")
         return one_geom_to_feature(row[0], {"source": "regions", "region_ids": region_ids})
@@ -260,18 +333,11 @@ def union_polygons(payload: Dict[str, Any] = Body(...)):
     if geoms:
         geom_list = [parse_geojson_geometry(g) for g in geoms]
         sql = """
-        WITH arr AS (
-          SELECT ARRAY(
-            SELECT ST_SetSRID(ST_GeomFromGeoJSON(x), 4326)
-            FROM unnest(%s::text[]) AS x
-          ) AS gs
-        )
-        SELECT ST_AsGeoJSON(ST_Union(gs))::json AS geom_geojson
-        FROM arr;
+        SELECT ST_AsGeoJSON(ST_Union(ST_GeomFromEWKB(x)))::json AS geom_geojson
+        FROM unnest($1::bytea[]) AS x;
         """
-        with get_conn() as conn, conn.cursor() as cur:
-            cur.execute(sql, ([json.dumps(g) for g in geom_list],))
-            row = cur.fetchone()
+        async with get_conn() as conn:
+            row = await conn.fetchrow(sql, await geoms_to_ewkb(conn, geom_list))
         return one_geom_to_feature(row[0], {"source": "geoms", "count": len(geom_list)})
 
     raise HTTPException(400, "Provide region_ids or geoms")
@@ -279,7 +345,7 @@ def union_polygons(payload: Dict[str, Any] = Body(...)):
 
 # ---------- 9) 求交：多边形交集（Intersection） ----------
 @app.post("/q/intersection")
-def intersection(payload: Dict[str, Any] = Body(...)):
+async def intersection(payload: Dict[str, Any] = Body(...)):
     a = payload.get("a")
     b = payload.get("b")
     if a is None or b is None:
@@ -291,18 +357,29 @@ def intersection(payload: Dict[str, Any] = Body(...)):
     sql = """
     WITH q AS (
       SELECT
-        ST_SetSRID(ST_GeomFromGeoJSON(%s), 4326) AS a,
-        ST_SetSRID(ST_GeomFromGeoJSON(%s), 4326) AS b
+        ST_GeomFromEWKB($1::bytea) AS a,
+        ST_GeomFromEWKB($2::bytea) AS b
+    ),
+    -- 一方包含另一方时直接返回被包含者，bbox 不相交时直接为空，避免计算完整的交集
+    -- MATERIALIZED：否则 CTE 会被内联，g 在下面两处各算一次
+    i AS MATERIALIZED (
+      SELECT CASE
+               WHEN NOT (a && b) THEN ST_GeomFromText('GEOMETRYCOLLECTION EMPTY', 4326)
+               WHEN ST_Contains(a, b) THEN b
+               WHEN ST_Contains(b, a) THEN a
+               ELSE ST_Intersection(a, b)
+             END AS g
+      FROM q
     )
     SELECT
-      ST_AsGeoJSON(ST_Intersection(a, b))::json AS geom_geojson,
-      ST_Area(ST_Intersection(a, b)::geography) AS area_m2
-    FROM q;
+      ST_AsGeoJSON(g)::json AS geom_geojson,
+      ST_Area(g::geography) AS area_m2
+    FROM i;
     """
 
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute(sql, (json.dumps(ga), json.dumps(gb)))
-        geom_geojson, area_m2 = cur.fetchone()
+    async with get_conn() as conn:
+        ewkb_a, ewkb_b = await geoms_to_ewkb(conn, [ga, gb])
+        geom_geojson, area_m2 = await conn.fetchrow(sql, ewkb_a, ewkb_b)
 
     if geom_geojson is None:
         return {"type": "Feature", "geometry": None, "properties": {"area_m2": 0.0}}
@@ -311,31 +388,110 @@ def intersection(payload: Dict[str, Any] = Body(...)):
 
 
 # ---------- 10) 坐标转换（Transform） ----------
+# geojson（默认）| wkb：wkb 时以 base64 返回目标投影的 WKB，由客户端自行解析
+TRANSFORM_FORMATS = ("geojson", "wkb")
+
+def transform_format(value):
+    out_format = str(value or "geojson").lower()
+    if out_format not in TRANSFORM_FORMATS:
+        raise HTTPException(400, "format must be 'geojson' or 'wkb'")
+    return out_format
+
+def transformed_props(wkb, to_epsg, out_format):
+    if out_format == "wkb":
+        return {"to_epsg": to_epsg, "geom_transformed_wkb": base64.b64encode(wkb).decode()}
+    return {"to_epsg": to_epsg, "geom_transformed": mapping(shapely.wkb.loads(wkb))}
+
 @app.post("/q/transform")
-def transform(payload: Dict[str, Any] = Body(...)):
+async def transform(payload: Dict[str, Any] = Body(...)):
     geojson = payload.get("geojson")
     to_epsg = int(payload.get("to_epsg", 3857))
+    out_format = transform_format(payload.get("format"))
     geom = parse_geojson_geometry(geojson)
 
     # 说明：Leaflet/GeoJSON 客户端默认按 EPSG:4326（经纬度）解释坐标。
     # 为了“既能可视化、又能拿到目标投影坐标”，这里返回：
-    #   - geometry: 仍为 4326（原始）用于前端直接显示
+    #   - geometry: 仍为 4326（原始，即已校验的输入）用于前端直接显示
     #   - properties.geom_transformed: 目标 EPSG 的几何（真正转换结果）
+    # PostGIS 只输出一份二进制 WKB，不再把两份几何格式化成 GeoJSON 文本
     sql = """
-    WITH q AS (
-      SELECT ST_SetSRID(ST_GeomFromGeoJSON(%s), 4326) AS g
-    )
-    SELECT
-      ST_AsGeoJSON(q.g)::json AS geom_wgs84,
-      ST_AsGeoJSON(ST_Transform(q.g, %s))::json AS geom_transformed
-    FROM q;
+    SELECT ST_AsBinary(ST_Transform(ST_GeomFromEWKB($1::bytea), $2::int));
     """
 
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute(sql, (json.dumps(geom), to_epsg))
-        geom_wgs84, geom_transformed = cur.fetchone()
+    async def compute():
+        async with get_conn() as conn:
+            wkb = await conn.fetchval(sql, await geom_to_ewkb(conn, geom), to_epsg)
+        return one_geom_to_feature(geom, transformed_props(wkb, to_epsg, out_format))
 
-    return one_geom_to_feature(
-        geom_wgs84,
-        {"to_epsg": to_epsg, "geom_transformed": geom_transformed}
+    key = f"transform:{to_epsg}:{out_format}:".encode() + geom_cache_key(geom)
+    return await cached_result(key, compute)
+
+
+# ---------- 11) 批量坐标转换（Transform batch） ----------
+# 一次请求转换多个几何：一条 SQL 对整个数组做 ST_Transform，PROJ 管线只初始化一次
+@app.post("/q/transform/batch")
+async def transform_batch(payload: Dict[str, Any] = Body(...)):
+    geoms = payload.get("geoms")
+    to_epsg = int(payload.get("to_epsg", 3857))
+    out_format = transform_format(payload.get("format"))
+    if not geoms:
+        raise HTTPException(400, "geoms required")
+
+    geom_list = [parse_geojson_geometry(g) for g in geoms]
+
+    sql = """
+    SELECT ST_AsBinary(ST_Transform(ST_GeomFromEWKB(e), $2::int))
+    FROM unnest($1::bytea[]) WITH ORDINALITY AS t(e, i)
+    ORDER BY i;
+    """
+
+    async with get_conn() as conn:
+        rows = await conn.fetch(sql, await geoms_to_ewkb(conn, geom_list), to_epsg)
+
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            one_geom_to_feature(g, transformed_props(r[0], to_epsg, out_format))
+            for g, r in zip(geom_list, rows)
+        ],
+    }
+
+
+# ---------- 12) 矢量切片（Mapbox Vector Tiles） ----------
+# 地图平移/缩放时按切片取二进制 MVT：已按切片裁剪、量化到 4096 网格，比 GeoJSON 小得多
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+# 低于该缩放级别的切片覆盖大半个城市乃至整张表，不做简化地编码会长时间占住连接：直接返回空切片
+TILE_MIN_ZOOM = int(os.getenv("TILE_MIN_ZOOM", 12))
+
+TILE_SQL = f"""
+WITH bounds AS (
+  SELECT ST_TileEnvelope($1, $2, $3) AS env,
+         ST_Transform(ST_TileEnvelope($1, $2, $3, margin => {TILE_BUFFER / TILE_EXTENT}), 4326) AS env_4326
+),
+mvtgeom AS (
+  SELECT id, osmid, element_type, name,
+         ST_AsMVTGeom(ST_Transform(f.geom, 3857), b.env, {TILE_EXTENT}, {TILE_BUFFER}, true) AS geom
+  FROM {FEATURES_TABLE} f, bounds b
+  WHERE f.geom && b.env_4326
+)
+SELECT ST_AsMVT(mvtgeom, 'features', {TILE_EXTENT}, 'geom')
+FROM mvtgeom
+WHERE geom IS NOT NULL;
+"""
+
+@app.get("/tiles/{z}/{x}/{y}.mvt")
+async def tile(z: int, x: int, y: int):
+    if not (0 <= z <= 24 and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(400, "invalid tile coordinates")
+
+    mvt = None
+    if z >= TILE_MIN_ZOOM:
+        async with get_conn() as conn:
+            mvt = await conn.fetchval(TILE_SQL, z, x, y)
+
+    return Response(
+        content=mvt or b"",
+        media_type="application/vnd.mapbox-vector-tile",
+        headers={"Cache-Control": "public, max-age=3600"},
     )
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# db.py 在导入时要求 DATABASE_URL；这些测试不连接数据库
+os.environ.setdefault("DATABASE_URL", "postgresql://test@localhost/test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,168 @@
+import asyncio
+import math
+
+import pytest
+
+import db
+
+
+def test_meters_to_degrees_at_equator():
+    dx, dy = db.meters_to_degrees(0.0, 1000.0)
+    assert dy == pytest.approx(1000.0 / 110574.0)
+    assert dx == pytest.approx(1000.0 / (111320.0 * math.cos(math.radians(dy))))
+
+
+def test_meters_to_degrees_covers_the_circle():
+    # bbox 预过滤只能偏大：dx 不小于纬度 lat 处同样距离对应的经度差
+    for lat in (-60.0, 0.0, 45.0, 59.9):
+        dx, dy = db.meters_to_degrees(lat, 5000.0)
+        assert dy >= 5000.0 / 111694.0
+        assert dx >= 5000.0 / (111320.0 * math.cos(math.radians(lat)))
+
+
+def test_meters_to_degrees_near_pole_is_finite():
+    dx, _ = db.meters_to_degrees(89.99, 1000.0)
+    assert math.isfinite(dx)
+
+
+class FakeEWKBConn:
+    """Answers the geoms_to_ewkb query with one fake EWKB per requested geometry."""
+
+    def __init__(self):
+        self.calls = []
+
+    async def fetch(self, sql, geoms):
+        self.calls.append(list(geoms))
+        return [(f"ewkb:{g['coordinates']}".encode(),) for g in geoms]
+
+
+@pytest.fixture
+def poly_cache(monkeypatch):
+    monkeypatch.setattr(db, "POLY_CACHE", db.OrderedDict())
+    monkeypatch.setattr(db, "POLY_CACHE_SIZE", 2)
+    return db.POLY_CACHE
+
+
+def point(x):
+    return {"type": "Point", "coordinates": [x, 0]}
+
+
+def test_geoms_to_ewkb_dedupes_and_keeps_order(poly_cache):
+    conn = FakeEWKBConn()
+    out = asyncio.run(db.geoms_to_ewkb(conn, [point(1), point(2), point(1)]))
+    assert out == [b"ewkb:[1, 0]", b"ewkb:[2, 0]", b"ewkb:[1, 0]"]
+    assert conn.calls == [[point(1), point(2)]]
+
+
+def test_geoms_to_ewkb_hits_skip_the_database(poly_cache):
+    conn = FakeEWKBConn()
+    asyncio.run(db.geoms_to_ewkb(conn, [point(1)]))
+    # 键与 dict 的键顺序无关
+    assert asyncio.run(db.geom_to_ewkb(conn, {"coordinates": [1, 0], "type": "Point"})) == b"ewkb:[1, 0]"
+    assert len(conn.calls) == 1
+
+
+def test_poly_cache_evicts_least_recently_used(poly_cache):
+    conn = FakeEWKBConn()
+    asyncio.run(db.geom_to_ewkb(conn, point(1)))
+    asyncio.run(db.geom_to_ewkb(conn, point(2)))
+    asyncio.run(db.geom_to_ewkb(conn, point(1)))  # 命中，1 变为最近使用
+    asyncio.run(db.geom_to_ewkb(conn, point(3)))  # 淘汰 2
+    assert list(poly_cache) == [db.geom_cache_key(point(1)), db.geom_cache_key(point(3))]
+
+
+class FakeTransaction:
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def start(self):
+        self.conn.in_tx = True
+
+    async def rollback(self):
+        self.conn.in_tx = False
+
+
+class FakeCursor:
+    def __init__(self, batches, error):
+        self.batches = batches
+        self.error = error
+
+    async def fetch(self, n):
+        if self.error:
+            raise self.error
+        return self.batches.pop(0) if self.batches else []
+
+
+class FakeStreamConn:
+    def __init__(self, batches=(), error=None):
+        self.batches = list(batches)
+        self.error = error
+        self.in_tx = False
+
+    def transaction(self):
+        return FakeTransaction(self)
+
+    def is_in_transaction(self):
+        return self.in_tx
+
+    async def cursor(self, sql, *args):
+        return FakeCursor(self.batches, self.error)
+
+
+class FakePool:
+    def __init__(self, conn):
+        self.conn = conn
+        self.released = 0
+
+    async def acquire(self):
+        return self.conn
+
+    async def release(self, conn):
+        self.released += 1
+
+
+async def no_args(conn):
+    return ()
+
+
+async def collect(rows_sql, conn):
+    stream = await db.stream_featurecollection(rows_sql, ("id",), no_args)
+    return "".join([chunk async for chunk in stream])
+
+
+def test_stream_featurecollection_joins_batches(monkeypatch):
+    conn = FakeStreamConn([[('{"a":1}',), ('{"a":2}',)], [('{"a":3}',)]])
+    pool = FakePool(conn)
+    monkeypatch.setattr(db, "POOL", pool)
+    body = asyncio.run(collect("SELECT 1", conn))
+    assert body == '{"type":"FeatureCollection","features":[{"a":1},{"a":2},{"a":3}]}'
+    assert pool.released == 1 and not conn.in_tx
+
+
+def test_stream_featurecollection_empty(monkeypatch):
+    conn = FakeStreamConn()
+    monkeypatch.setattr(db, "POOL", FakePool(conn))
+    assert asyncio.run(collect("SELECT 1", conn)) == '{"type":"FeatureCollection","features":[]}'
+
+
+def test_stream_featurecollection_first_batch_error_raises(monkeypatch):
+    # 第一批就失败时应直接抛出（由 FastAPI 返回错误状态码），而不是返回半截的 200
+    conn = FakeStreamConn(error=RuntimeError("TopologyException"))
+    pool = FakePool(conn)
+    monkeypatch.setattr(db, "POOL", pool)
+    with pytest.raises(RuntimeError):
+        asyncio.run(db.stream_featurecollection("SELECT 1", ("id",), no_args))
+    assert pool.released == 1 and not conn.in_tx
+
+
+def test_stream_featurecollection_closed_early_releases(monkeypatch):
+    conn = FakeStreamConn([[('{"a":1}',)]])
+    pool = FakePool(conn)
+    monkeypatch.setattr(db, "POOL", pool)
+
+    async def run():
+        stream = await db.stream_featurecollection("SELECT 1", ("id",), no_args)
+        await stream.aclose()
+
+    asyncio.run(run())
+    assert pool.released == 1 and not conn.in_tx
@@ -0,0 +1,49 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from db import parse_geojson_geometry
+
+POINT = {"type": "Point", "coordinates": [30.3, 59.9]}
+
+
+def test_geometry_passes_through():
+    assert parse_geojson_geometry(POINT) == POINT
+
+
+def test_feature_is_unwrapped():
+    assert parse_geojson_geometry({"type": "Feature", "geometry": POINT, "properties": {}}) == POINT
+
+
+def test_string_input_is_parsed():
+    assert parse_geojson_geometry('{"type": "Point", "coordinates": [30.3, 59.9]}') == POINT
+
+
+@pytest.mark.parametrize("bad", [
+    None,
+    "not json",
+    '"a string"',
+    {"coordinates": [0, 0]},
+    {"type": "Feature", "geometry": None},
+    {"type": "FeatureCollection", "features": [{"type": "Feature", "geometry": POINT}]},
+    {"type": "Polygon"},
+    {"type": "GeometryCollection"},
+    {"type": "GeometryCollection", "geometries": [POINT, {"type": "LineString"}]},
+    {"type": "GeometryCollection", "geometries": [{"type": "Circle", "coordinates": [0, 0]}]},
+])
+def test_invalid_input_raises_value_error(bad):
+    with pytest.raises(ValueError):
+        parse_geojson_geometry(bad)
+
+
+def test_geometry_collection_with_valid_members():
+    gc = {"type": "GeometryCollection", "geometries": [POINT, {"type": "LineString", "coordinates": [[0, 0], [1, 1]]}]}
+    assert parse_geojson_geometry(gc) == gc
+
+
+def test_value_error_becomes_400():
+    # 校验在取连接之前完成，不需要数据库
+    client = TestClient(main.app)
+    r = client.post("/q/area", json={"geojson": {"type": "Feature", "geometry": None}})
+    assert r.status_code == 400
+    assert "detail" in r.json()